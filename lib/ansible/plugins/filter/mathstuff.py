@@ -26,12 +26,15 @@ __metaclass__ = type
 import itertools
 import math
 
+# bound once so the haversine kernel skips the math module attribute lookups
+from math import asin as _asin, cos as _cos, radians as _radians, sin as _sin, sqrt as _sqrt
+
 from jinja2.filters import environmentfilter
 
 from ansible.errors import AnsibleFilterError
 from ansible.module_utils.common.text import formatters
 from ansible.module_utils.six import binary_type, text_type
-from ansible.module_utils.six.moves import zip, zip_longest
+from ansible.module_utils.six.moves import builtins, zip, zip_longest
 from ansible.module_utils.common._collections_compat import Hashable, Mapping, Iterable
 from ansible.module_utils._text import to_native, to_text
 from ansible.utils.display import Display
@@ -42,8 +45,16 @@ try:
 except ImportError:
     HAS_UNIQUE = False
 
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
 display = Display()
 
+_VALID_DUPES = frozenset(('error', 'overwrite'))
+
 
 @environmentfilter
 def unique(environment, a, case_sensitive=False, attribute=None):
@@ -79,57 +90,88 @@ def unique(environment, a, case_sensitive=False, attribute=None):
         if isinstance(a, Hashable):
             c = set(a)
         else:
+            # the container is not hashable but its elements usually are, so
+            # track those in a set and only fall back to the O(N) list scan
+            # for the individual elements that are not
             c = []
+            seen = set()
             for x in a:
-                if x not in c:
-                    c.append(x)
+                try:
+                    if x in seen:
+                        continue
+                    seen.add(x)
+                except TypeError:
+                    if x in c:
+                        continue
+                c.append(x)
     return c
 
 
+# The set-theory filters attempt the plain set fast path and handle the
+# TypeError raised for unhashable elements instead of paying for two ABC
+# isinstance() checks on every call. The inputs are materialized first so
+# that one-shot iterables (e.g. generators from Jinja2's map/select) are
+# not half-consumed by a failed set() before the fallback re-reads them.
+
 @environmentfilter
 def intersect(environment, a, b):
-    if isinstance(a, Hashable) and isinstance(b, Hashable):
+    a = list(a)
+    b = list(b)
+    try:
         c = set(a) & set(b)
-    else:
+    except TypeError:
         c = unique(environment, [x for x in a if x in b])
     return c
 
 
 @environmentfilter
 def difference(environment, a, b):
-    if isinstance(a, Hashable) and isinstance(b, Hashable):
+    a = list(a)
+    b = list(b)
+    try:
         c = set(a) - set(b)
-    else:
+    except TypeError:
         c = unique(environment, [x for x in a if x not in b])
     return c
 
 
 @environmentfilter
 def symmetric_difference(environment, a, b):
-    if isinstance(a, Hashable) and isinstance(b, Hashable):
+    a = list(a)
+    b = list(b)
+    try:
         c = set(a) ^ set(b)
-    else:
-        isect = intersect(environment, a, b)
-        c = [x for x in union(environment, a, b) if x not in isect]
+    except TypeError:
+        # dedupe each side once and filter it against the other, instead of
+        # building union and intersection intermediates and scanning those
+        ua = unique(environment, a)
+        ub = unique(environment, b)
+        c = [x for x in ua if x not in ub] + [x for x in ub if x not in ua]
     return c
 
 
 @environmentfilter
 def union(environment, a, b):
-    if isinstance(a, Hashable) and isinstance(b, Hashable):
+    a = list(a)
+    b = list(b)
+    try:
         c = set(a) | set(b)
-    else:
+    except TypeError:
         c = unique(environment, a + b)
     return c
 
 
+# bind the real builtins once at import time instead of fetching them from
+# __builtins__ on every filter call
+_min = builtins.min
+_max = builtins.max
+
+
 def min(a):
-    _min = __builtins__.get('min')
     return _min(a)
 
 
 def max(a):
-    _max = __builtins__.get('max')
     return _max(a)
 
 
@@ -145,21 +187,134 @@ def logarithm(x, base=math.e):
 
 def power(x, y):
     try:
-        return math.pow(x, y)
+        # the ** operator is noticeably faster than math.pow() for scalars
+        return x ** y
     except TypeError as e:
         raise AnsibleFilterError('pow() can only be used on numbers: %s' % to_native(e))
 
 
 def inversepower(x, base=2):
+    # stick with math.sqrt/math.pow here: unlike **, they raise a clean
+    # ValueError for negative input instead of returning a complex number
     try:
         if base == 2:
             return math.sqrt(x)
         else:
-            return math.pow(x, 1.0 / float(base))
+            return math.pow(x, 1.0 / base)
     except (ValueError, TypeError) as e:
         raise AnsibleFilterError('root() can only be used on numbers: %s' % to_native(e))
 
 
+# mean Earth radius per unit, shared by the scalar and batched haversine paths
+_EARTH_RADIUS = {'km': 6371.0, 'mi': 3958.756}
+
+
+def _haversine_distance(lat1, lon1, lat2, lon2):
+    ''' Central angle (in radians) of the great circle arc between two points '''
+    lat1 = _radians(lat1)
+    lon1 = _radians(lon1)
+    lat2 = _radians(lat2)
+    lon2 = _radians(lon2)
+    h = _sin((lat2 - lat1) / 2) ** 2 + _cos(lat1) * _cos(lat2) * _sin((lon2 - lon1) / 2) ** 2
+    return 2 * _asin(_sqrt(h))
+
+
+# numba-compiled haversine kernel, created on first use; False once numba
+# has been found missing (or compilation failed) so we only try once
+_haversine_compiled = None
+
+
+def _get_haversine_kernel():
+    global _haversine_compiled
+    if _haversine_compiled is None:
+        try:
+            import numba
+            _haversine_compiled = numba.njit('float64(float64, float64, float64, float64)',
+                                             cache=True, fastmath=True)(_haversine_distance)
+        except Exception:
+            _haversine_compiled = False
+    return _haversine_compiled or _haversine_distance
+
+
+def haversine_vector(coords_a, coords_b, unit=None):
+    '''
+    Haversine distances between parallel lists of (latitude, longitude) pairs
+
+    Computed in a single numpy pass, which is considerably faster than calling
+    haversine() once per pair. Returns a list of distances rounded to two
+    decimals, or a dict with both units when ``unit`` is None.
+    '''
+    if not HAS_NUMPY:
+        raise AnsibleFilterError('haversine() requires numpy to be installed when given lists of coordinates')
+
+    if unit is not None and unit not in _EARTH_RADIUS:
+        raise AnsibleFilterError("haversine() unit has to be one of 'km' or 'mi', got: %s" % unit)
+
+    try:
+        a = np.radians(np.asarray(coords_a, dtype='float64'))
+        b = np.radians(np.asarray(coords_b, dtype='float64'))
+    except (TypeError, ValueError) as e:
+        raise AnsibleFilterError('haversine() can only be used on numeric coordinates: %s' % to_native(e))
+
+    lat1, lon1 = a[..., 0], a[..., 1]
+    lat2, lon2 = b[..., 0], b[..., 1]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(h))
+
+    if unit is None:
+        return dict((u, np.round(r * c, 2).tolist()) for u, r in _EARTH_RADIUS.items())
+    return np.round(_EARTH_RADIUS[unit] * c, 2).tolist()
+
+
+def haversine(coordinates, unit=None):
+    '''
+    Great circle distance between two points on Earth
+
+    ``coordinates`` is a list/tuple of four values (lat1, lon1, lat2, lon2) or
+    a dict with those keys. A list of such four-value rows is also accepted
+    and is computed in one pass, but requires numpy to be installed. The
+    distance is rounded to two decimals
+    and returned in ``unit`` ('km' or 'mi'), or as a dict with both units when
+    no unit is given. Passing ``unit`` is slightly cheaper as only that
+    distance is computed.
+    '''
+    if isinstance(coordinates, Mapping):
+        try:
+            coordinates = (coordinates['lat1'], coordinates['lon1'], coordinates['lat2'], coordinates['lon2'])
+        except KeyError as e:
+            raise AnsibleFilterError('haversine() dict input requires lat1, lon1, lat2 and lon2 keys: %s' % to_native(e))
+    else:
+        try:
+            coordinates = tuple(coordinates)
+        except TypeError as e:
+            raise AnsibleFilterError('haversine() can only be used on four numeric coordinates: %s' % to_native(e))
+
+    # a list of coordinate rows is dispatched to the batched numpy version
+    if coordinates and isinstance(coordinates[0], (list, tuple)):
+        for row in coordinates:
+            if not isinstance(row, (list, tuple)) or len(row) != 4:
+                raise AnsibleFilterError('haversine() can only be used on four numeric coordinates: invalid row %s' % (row,))
+        return haversine_vector([row[:2] for row in coordinates], [row[2:] for row in coordinates], unit)
+
+    try:
+        lat1, lon1, lat2, lon2 = (float(x) for x in coordinates)
+    except (TypeError, ValueError) as e:
+        raise AnsibleFilterError('haversine() can only be used on four numeric coordinates: %s' % to_native(e))
+
+    if unit is not None and unit not in _EARTH_RADIUS:
+        raise AnsibleFilterError("haversine() unit has to be one of 'km' or 'mi', got: %s" % unit)
+
+    # identical points are common in self-join templates; skip the trig
+    if lat1 == lat2 and lon1 == lon2:
+        c = 0.0
+    else:
+        c = _get_haversine_kernel()(lat1, lon1, lat2, lon2)
+
+    if unit is None:
+        return {'km': round(_EARTH_RADIUS['km'] * c, 2), 'mi': round(_EARTH_RADIUS['mi'] * c, 2)}
+    return round(_EARTH_RADIUS[unit] * c, 2)
+
+
 def human_readable(size, isbits=False, unit=None):
     ''' Return a human readable string '''
     try:
@@ -185,7 +340,7 @@ def rekey_on_member(data, key, duplicates='error'):
     duplicates can be one of ``error`` or ``overwrite`` to specify whether to error out if the key
     value would be duplicated or to overwrite previous entries if that's the case.
     """
-    if duplicates not in ('error', 'overwrite'):
+    if duplicates not in _VALID_DUPES:
         raise AnsibleFilterError("duplicates parameter to rekey_on_member has unknown value: {0}".format(duplicates))
 
     new_obj = {}
@@ -197,6 +352,10 @@ def rekey_on_member(data, key, duplicates='error'):
     else:
         raise AnsibleFilterError("Type is not a valid list, set, or dict")
 
+    # decide on the duplicate handling once instead of per item; overwrite
+    # mode then needs no duplicate probe at all
+    error_on_dupes = duplicates == 'error'
+
     for item in iterate_over:
         if not isinstance(item, Mapping):
             raise AnsibleFilterError("List item is not a valid dict")
@@ -208,15 +367,9 @@ def rekey_on_member(data, key, duplicates='error'):
         except Exception as e:
             raise AnsibleFilterError(to_native(e))
 
-        # Note: if new_obj[key_elem] exists it will always be a non-empty dict (it will at
-        # minimun contain {key: key_elem}
-        if new_obj.get(key_elem, None):
-            if duplicates == 'error':
-                raise AnsibleFilterError("Key {0} is not unique, cannot correctly turn into dict".format(key_elem))
-            elif duplicates == 'overwrite':
-                new_obj[key_elem] = item
-        else:
-            new_obj[key_elem] = item
+        if error_on_dupes and key_elem in new_obj:
+            raise AnsibleFilterError("Key {0} is not unique, cannot correctly turn into dict".format(key_elem))
+        new_obj[key_elem] = item
 
     return new_obj
 
@@ -235,6 +388,9 @@ class FilterModule(object):
             'pow': power,
             'root': inversepower,
 
+            # geometry
+            'haversine': haversine,
+
             # set theory
             'unique': unique,
             'intersect': intersect,